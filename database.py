@@ -43,12 +43,19 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     result = db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None,
+                  sort: list = None, projection: dict = None):
+    """Get documents from collection, optionally sorted and projected server-side
+
+    sort is a list of (field, direction) pairs, e.g. [("order", 1)];
+    projection is a pymongo projection, e.g. {"_id": 0}.
+    """
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
         cursor = cursor.limit(limit)
     
@@ -1,47 +1,114 @@
-import json, re
+import io, json, mmap, os, re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List
 
-CTRL_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+import ijson
+import orjson
+
+from text_utils import slugify
+
+# Maps the other tag separators onto "," so a plain str.split can be used
+SEP_TABLE = str.maketrans("/|;", ",,,")
 TRUNCATED_LINE_RE = re.compile(rb"^\s*\.\.\. \(truncated.*\) \.\.\.\s*$")
 TRIPLE_DASH_RE = re.compile(rb"^\s*---\s*$")
+# A complete JSON string literal, honouring backslash escapes
+STRING_RE = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+# Control bytes other than \t, \n and \r, for bytes.translate(None, CTRL_BYTES)
+CTRL_BYTES = bytes(range(0x00, 0x09)) + b"\x0b\x0c" + bytes(range(0x0e, 0x20))
+# Same set as a str.translate deletion table and as a str pattern
+CTRL_CHARS_TABLE = dict.fromkeys(CTRL_BYTES)
+CTRL_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# Raw chapter fields that are only read to build the body, then dropped
+CHAPTER_SOURCE_KEYS = frozenset({"content", "paragraphs", "text", "audio_url", "published"})
+# Top-level values copied to the output as-is (after sanitizing)
+PASSTHROUGH_KEYS = ("glossary", "bibliography", "ready_for_import", "manifest_version")
+# Precleaned manifests larger than this are stream-parsed one chapter at a time
+STREAM_THRESHOLD = 64 * 1024 * 1024
+# In-memory chapter lists at least this long are transformed in a process pool
+PARALLEL_THRESHOLD = 1000
 
 
 def clean_str(s: str) -> str:
     if not isinstance(s, str):
         s = str(s)
+    # Single-line text without control chars (titles, tags, ...) needs no copy
+    if s.isprintable():
+        return s
+    # translate has a fast path for ASCII but is slow per char otherwise, where
+    # an allocation-free regex scan settles the (common) clean case instead
+    if s.isascii():
+        return s.translate(CTRL_CHARS_TABLE)
+    if CTRL_CHARS_RE.search(s) is None:
+        return s
     return CTRL_CHARS_RE.sub("", s)
 
 
 def extract_text_from_block(block) -> str:
-    if isinstance(block, str):
-        return clean_str(block)
-    if isinstance(block, (int, float, bool)):
-        return clean_str(str(block))
-    if isinstance(block, dict):
-        parts = []
-        for key in ("text", "paragraph"):
-            if key in block and isinstance(block[key], (str, int, float, bool)):
-                parts.append(clean_str(block[key]))
-        if "content" in block:
-            c = block["content"]
-            if isinstance(c, list):
-                parts.extend(extract_text_from_block(x) for x in c)
-            elif isinstance(c, (str, int, float, bool, dict)):
-                parts.append(extract_text_from_block(c))
-        if "children" in block and isinstance(block["children"], list):
-            parts.extend(extract_text_from_block(x) for x in block["children"])
-        if not parts:
-            for v in block.values():
-                if isinstance(v, (str, int, float, bool)):
-                    parts.append(clean_str(v))
-        return "\n".join(p for p in parts if p)
-    if isinstance(block, list):
-        return "\n\n".join(extract_text_from_block(x) for x in block if x is not None)
-    return ""
+    """Flatten a content block to plain text.
+
+    Dict parts are joined with a newline (empty parts skipped), list items with a
+    blank line. The block is walked with an explicit stack and every piece is
+    appended to a single output list that is joined once at the end.
+    """
+    out: List[str] = []
+    # (op, item, mark): "node" emits item, "sep" writes item verbatim, "part"
+    # emits item as one part of a dict starting at out[mark], "end" removes the
+    # part separator at out[mark] again when the part turned out empty
+    stack = [("node", block, 0)]
+    while stack:
+        op, item, mark = stack.pop()
+        if op == "sep":
+            out.append(item)
+            continue
+        if op == "end":
+            if mark >= 0 and len(out) == mark + 1:
+                out.pop()
+            continue
+        if op == "part":
+            n = len(out)
+            if n > mark:
+                out.append("\n")
+            else:
+                n = -1
+            stack.append(("end", None, n))
+        if isinstance(item, (str, int, float, bool)):
+            text = clean_str(item)
+            if text:
+                out.append(text)
+        elif isinstance(item, dict):
+            parts = []
+            for key in ("text", "paragraph"):
+                if key in item and isinstance(item[key], (str, int, float, bool)):
+                    parts.append(item[key])
+            if "content" in item:
+                c = item["content"]
+                if isinstance(c, list):
+                    parts.extend(c)
+                elif isinstance(c, (str, int, float, bool, dict)):
+                    parts.append(c)
+            if "children" in item and isinstance(item["children"], list):
+                parts.extend(item["children"])
+            if not parts:
+                parts = [v for v in item.values() if isinstance(v, (str, int, float, bool))]
+            start = len(out)
+            for part in reversed(parts):
+                stack.append(("part", part, start))
+        elif isinstance(item, list):
+            items = [x for x in item if x is not None]
+            for i in range(len(items) - 1, -1, -1):
+                stack.append(("node", items[i], 0))
+                if i:
+                    stack.append(("sep", "\n\n", 0))
+    return "".join(out)
 
 
 def to_int(value, default=0):
+    # JSON numbers and plain digit strings skip the int()/except round trip
+    if type(value) is int:
+        return value
+    if isinstance(value, str) and value.isdecimal():
+        return int(value)
     try:
         return int(value)
     except Exception:
@@ -54,68 +121,70 @@ def as_list(value) -> List[str]:
     if isinstance(value, list):
         return [clean_str(str(v)) for v in value if v is not None]
     # split common separators
-    s = clean_str(str(value))
-    parts = re.split(r"[,/|;]", s)
-    return [p.strip() for p in parts if p and p.strip()]
+    s = clean_str(str(value)).translate(SEP_TABLE)
+    return [p for p in (x.strip() for x in s.split(",")) if p]
 
 
 def sanitize_strings(obj):
+    # Strings are by far the most common leaf, so test for them first
+    if isinstance(obj, str):
+        return clean_str(obj)
     if isinstance(obj, dict):
         return {k: sanitize_strings(v) for k, v in obj.items()}
     if isinstance(obj, list):
         return [sanitize_strings(x) for x in obj]
-    if isinstance(obj, str):
-        return clean_str(obj)
     return obj
 
 
 def transform_chapter(ch: Dict[str, Any]) -> Dict[str, Any]:
-    ch = dict(ch)
+    """Normalize a freshly parsed chapter dict in place and return it."""
+    # Clean every field that is kept; the source fields are cleaned while
+    # extracting the body (or not at all when dropped)
+    for k, v in ch.items():
+        if k not in CHAPTER_SOURCE_KEYS:
+            ch[k] = sanitize_strings(v)
     if "number" in ch:
-        ch["number"] = to_int(ch["number"])
-    if "order" in ch:
-        ch["order"] = to_int(ch["order"]) or ch.get("number", 0)
+        ch["number"] = number = to_int(ch["number"])
     else:
-        ch["order"] = ch.get("number", 0)
+        number = 0
+    ch["order"] = order = (to_int(ch["order"]) or number) if "order" in ch else number
     # slug
-    if not ch.get("slug"):
-        base = (ch.get("title") or f"chapter-{ch['order']}")
-        base = clean_str(str(base)).lower()
-        ch["slug"] = re.sub(r"[^a-z0-9]+", "-", base).strip("-")
+    title = ch.get("title")
+    slug = ch.get("slug")
+    if not slug:
+        ch["slug"] = slugify(str(title or f"chapter-{order}"))
     else:
-        ch["slug"] = clean_str(str(ch["slug"]))
+        ch["slug"] = str(slug)
     # title
-    if ch.get("title"):
-        ch["title"] = clean_str(str(ch["title"]))
-    else:
-        ch["title"] = f"Chapter {ch['order']}"
+    ch["title"] = str(title) if title else f"Chapter {order}"
     # summary optional normalize
-    if isinstance(ch.get("summary"), str):
-        ch["summary"] = clean_str(ch["summary"])  # type: ignore
-    else:
-        ch["summary"] = ch.get("summary") or ""
+    ch["summary"] = ch.get("summary") or ""
     # lists
     ch["tags"] = as_list(ch.get("tags"))
     ch["themes"] = as_list(ch.get("themes"))
-    # body
-    if isinstance(ch.get("body"), str) and ch["body"].strip():
-        ch["body"] = clean_str(ch["body"])  # type: ignore
-    else:
-        content = ch.get("content")
-        body_text = extract_text_from_block(content) if content is not None else ""
-        if not body_text and "paragraphs" in ch:
-            body_text = extract_text_from_block(ch["paragraphs"])  # type: ignore
-        if not body_text and "text" in ch:
-            body_text = extract_text_from_block(ch["text"])  # type: ignore
-        ch["body"] = clean_str(body_text)
+    # cover image in the CoverImage shape, so readers never have to special-case a bare URL
+    cover = ch.get("cover_image")
+    if isinstance(cover, str):
+        ch["cover_image"] = {"url": cover or None, "concept": None, "alt_text": None}
+    # body, falling back to the first source field that yields text
+    body = ch.get("body")
+    if not (isinstance(body, str) and body.strip()):
+        ch["body"] = (
+            extract_text_from_block(ch.get("content"))
+            or extract_text_from_block(ch.get("paragraphs"))
+            or extract_text_from_block(ch.get("text"))
+        )
+    # keep a usable word count, else do a naive count once while the body is at hand
+    wc = to_int(ch.get("word_count"), None)
+    ch["word_count"] = wc if wc is not None else len(ch["body"].split())
     # cleanup noisy fields
-    for k in ("content", "paragraphs", "text", "audio_url", "published"):
+    for k in CHAPTER_SOURCE_KEYS:
         ch.pop(k, None)
     return ch
 
 
-def normalize_book(book: Dict[str, Any], chapters: List[Dict[str, Any]]) -> Dict[str, Any]:
-    b = dict(book)
+def normalize_book(book: Dict[str, Any], total_chapters: int, total_word_count: int) -> Dict[str, Any]:
+    b = sanitize_strings(book)
     # required
     b["title"] = clean_str(str(b.get("title", "Untitled")))
     b["author"] = clean_str(str(b.get("author", "Unknown")))
@@ -132,26 +201,38 @@ def normalize_book(book: Dict[str, Any], chapters: List[Dict[str, Any]]) -> Dict
     # tags list
     b["tags"] = as_list(b.get("tags"))
     # computed
-    if chapters:
-        b["total_chapters"] = len(chapters)
-        total_wc = 0
-        for ch in chapters:
-            wc = ch.get("word_count")
-            try:
-                if wc is None:
-                    # naive count if absent
-                    wc = len((ch.get("body") or "").split())
-                total_wc += int(wc)
-            except Exception:
-                pass
-        b["total_word_count"] = total_wc or None
+    if total_chapters:
+        b["total_chapters"] = total_chapters
+        b["total_word_count"] = total_word_count or None
     return b
 
 
+def read_json_region(path: Path) -> bytes:
+    """Read only the lines spanning the outer {...} region of a file.
+
+    The file is memory-mapped so the surrounding chatter is never copied; the
+    slice is the only copy made. Whole lines are kept so preclean_bytes still
+    sees (and drops) placeholder lines that contain a brace.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = mm.find(b"{")
+            end = mm.rfind(b"}")
+            if start != -1 and end > start:
+                start = max(mm.rfind(b"\n", 0, start), mm.rfind(b"\r", 0, start)) + 1
+                ends = [i for i in (mm.find(b"\n", end), mm.find(b"\r", end)) if i != -1]
+                return mm[start:min(ends) if ends else len(mm)]
+            return mm[:]
+
+
 def preclean_bytes(data: bytes) -> bytes:
-    """Pre-clean the raw bytes to strip invalid lines and truncate to JSON body."""
-    # Remove control chars except allowed whitespace
-    data = re.sub(b"[\x00-\x08\x0b\x0c\x0e-\x1f]", b"", data)
+    """Pre-clean the raw bytes to strip invalid lines, truncate to JSON body and
+    escape raw newlines inside string literals, so the result is ready for parsing.
+    """
+    # Remove control chars except allowed whitespace (single C-level pass)
+    data = data.translate(None, CTRL_BYTES)
     # Drop editorial placeholder lines or standalone markdown separators
     lines = []
     for line in data.splitlines():
@@ -167,96 +248,163 @@ def preclean_bytes(data: bytes) -> bytes:
     end = data.rfind(b"}")
     if start != -1 and end != -1 and end > start:
         data = data[start:end+1]
-    return data
+    # Escape raw newlines inside strings to make it JSON compliant
+    return escape_newlines_inside_strings(data)
+
+
+def _escape_string_literal(m: re.Match) -> bytes:
+    return m.group().replace(b"\n", b"\\n").replace(b"\r", b"\\n")
 
 
 def escape_newlines_inside_strings(data: bytes) -> bytes:
     """Replace raw newlines (\n, \r) inside JSON string literals with escaped \n so that json.loads can parse.
-    We scan byte-by-byte tracking whether we're inside a string and whether previous char was an escape.
+    String literals are located with STRING_RE, so the scan runs inside the regex engine rather than byte-by-byte.
     """
-    out = bytearray()
-    in_string = False
-    escaped = False
-    for b in data:
-        ch = chr(b)
-        if in_string:
-            if escaped:
-                out.append(b)
-                escaped = False
-            else:
-                if ch == '\\':
-                    out.append(b)
-                    escaped = True
-                elif ch == '"':
-                    out.append(b)
-                    in_string = False
-                elif ch == '\n':
-                    out.extend(b"\\n")
-                elif ch == '\r':
-                    # drop or convert CR
-                    out.extend(b"\\n")
-                else:
-                    out.append(b)
-        else:
-            if ch == '"':
-                out.append(b)
-                in_string = True
-                escaped = False
-            else:
-                out.append(b)
-    return bytes(out)
+    return STRING_RE.sub(_escape_string_literal, data)
 
 
-def main():
-    src = Path("import_manifest.json")
-    dst = Path("cleaned_import_manifest.json")
-    rb = open(src, "rb").read()
-    rb = preclean_bytes(rb)
-    # Escape raw newlines inside strings to make it JSON compliant
-    rb = escape_newlines_inside_strings(rb)
-    # Attempt to load JSON now
+def load_manifest(data: bytes) -> Dict[str, Any]:
+    """Parse a precleaned manifest in one go."""
     try:
-        raw = json.loads(rb)
-    except json.JSONDecodeError as e:
-        # As a last resort remove any lingering invalid control chars again and try
-        rb2 = re.sub(b"[\x00-\x08\x0b\x0c\x0e-\x1f]", b"", rb)
-        raw = json.loads(rb2)
-    raw = sanitize_strings(raw)
-
+        raw = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # As a last resort let the more lenient stdlib parser try (e.g. lone
+        # surrogates, NaN); control chars are already gone after preclean_bytes
+        raw = json.loads(data)
     # Expect top-level dict with book/chapters
     if not isinstance(raw, dict):
         raise ValueError("Top-level JSON must be an object with 'book' and 'chapters'")
+    return raw
+
+
+def _build_value(event: str, value: Any, events: Iterator) -> Any:
+    """Build the JSON value that starts with (event, value) from ijson basic_parse events."""
+    builder = ijson.ObjectBuilder()
+    depth = 0
+    while True:
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+        event, value = next(events)
+
+
+def iter_manifest(data: bytes, raw: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Stream-parse a precleaned manifest, yielding the top-level chapters one at a time.
 
-    chapters_in: List[Dict[str, Any]] = []
-    if "chapters" in raw and isinstance(raw["chapters"], list):
-        chapters_in = [transform_chapter(ch) for ch in raw["chapters"]]
-    elif "book" in raw and isinstance(raw["book"], dict) and "chapters" in raw["book"]:
-        chs = raw["book"]["chapters"]
-        if isinstance(chs, list):
-            chapters_in = [transform_chapter(ch) for ch in chs]
-
-    # book normalization
-    if "book" in raw and isinstance(raw["book"], dict):
-        raw["book"] = normalize_book(raw["book"], chapters_in)
+    Every other top-level value is built into ``raw`` as parsing reaches it; the
+    streamed chapters array itself is recorded there as an empty list.
+    """
+    events = ijson.basic_parse(io.BytesIO(data), use_float=True)
+    event, _ = next(events)
+    if event != "start_map":
+        raise ValueError("Top-level JSON must be an object with 'book' and 'chapters'")
+    for event, key in events:
+        if event == "end_map":
+            return
+        event, value = next(events)
+        if key == "chapters" and event == "start_array":
+            raw["chapters"] = []
+            for event, value in events:
+                if event == "end_array":
+                    break
+                yield _build_value(event, value, events)
+        else:
+            raw[key] = _build_value(event, value, events)
+
+
+def transform_chapters(chapters: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Transform chapters in order, fanning long in-memory lists out to a process pool.
+
+    Streamed chapters are transformed in-process so they are never all queued up at once.
+    """
+    workers = os.cpu_count() or 1
+    if workers > 1 and isinstance(chapters, list) and len(chapters) >= PARALLEL_THRESHOLD:
+        chunksize = max(1, len(chapters) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            yield from ex.map(transform_chapter, chapters, chunksize=chunksize)
     else:
-        # If missing, synthesize a minimal book
-        raw["book"] = normalize_book({
-            "title": "Sacred Circuits: The Odyssey",
-            "author": "Unknown",
-        }, chapters_in)
+        yield from map(transform_chapter, chapters)
 
-    # ensure chapters live at top-level key
-    raw["chapters"] = chapters_in
 
-    # Drop unexpected top-level keys that could trip validation (keep glossary/bibliography if present)
-    allowed_top = {"book", "chapters", "glossary", "bibliography", "ready_for_import", "manifest_version"}
-    raw = {k: v for k, v in raw.items() if k in allowed_top}
+def iter_transformed(raw: Dict[str, Any], chapters: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    yield from transform_chapters(chapters)
+    # Chapters nested under book are only used when there is no top-level list;
+    # checked only now, once raw is complete
+    book = raw.get("book")
+    if not isinstance(raw.get("chapters"), list) and isinstance(book, dict):
+        if isinstance(book.get("chapters"), list):
+            # transform_chapter works in place and the book keeps its copy
+            yield from transform_chapters([dict(ch) for ch in book["chapters"]])
 
-    # defaults
-    raw.setdefault("ready_for_import", True)
-    raw.setdefault("manifest_version", "1.0")
 
-    dst.write_text(json.dumps(raw, ensure_ascii=False))
+def write_manifest(dst: Path, raw: Dict[str, Any], chapters: Iterable[Dict[str, Any]]) -> None:
+    """Transform and write chapters one by one, then the book and other top-level keys.
+
+    ``raw`` only has to be complete once ``chapters`` is exhausted, so it can be
+    filled in by iter_manifest while the chapters stream through.
+    """
+    tmp = dst.with_name(dst.name + ".tmp")
+    total_chapters = 0
+    total_word_count = 0
+    # A failed transform or parse error must not leave the partial temp file behind
+    try:
+        with tmp.open("wb") as out:
+            out.write(b'{"chapters":[')
+            for ch in iter_transformed(raw, chapters):
+                if total_chapters:
+                    out.write(b",")
+                # orjson emits UTF-8 without ASCII-escaping, same as ensure_ascii=False
+                out.write(orjson.dumps(ch))
+                total_chapters += 1
+                total_word_count += ch["word_count"]
+
+            # book normalization
+            if isinstance(raw.get("book"), dict):
+                book = normalize_book(raw["book"], total_chapters, total_word_count)
+            else:
+                # If missing, synthesize a minimal book
+                book = normalize_book({
+                    "title": "Sacred Circuits: The Odyssey",
+                    "author": "Unknown",
+                }, total_chapters, total_word_count)
+
+            # Unexpected top-level keys that could trip validation are dropped;
+            # book and chapters were cleaned by their transforms, sanitize the rest as-is
+            tail = {"book": book}
+            for k in PASSTHROUGH_KEYS:
+                if k in raw:
+                    tail[k] = sanitize_strings(raw[k])
+
+            # defaults
+            tail.setdefault("ready_for_import", True)
+            tail.setdefault("manifest_version", "1.0")
+
+            # Continue the open object: drop the leading "{" of the serialized tail
+            out.write(b"],")
+            out.write(orjson.dumps(tail)[1:])
+        tmp.replace(dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def main():
+    src = Path("import_manifest.json")
+    dst = Path("cleaned_import_manifest.json")
+    rb = read_json_region(src)
+    rb = preclean_bytes(rb)
+    if len(rb) > STREAM_THRESHOLD:
+        # Only one raw chapter is held in memory at a time
+        raw: Dict[str, Any] = {}
+        chapters: Iterable[Dict[str, Any]] = iter_manifest(rb, raw)
+    else:
+        raw = load_manifest(rb)
+        chapters = raw["chapters"] if isinstance(raw.get("chapters"), list) else []
+    write_manifest(dst, raw, chapters)
     print(f"Wrote {dst}")
 
 
@@ -1,7 +1,10 @@
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
-app = FastAPI(title="API Offline")
+app = FastAPI(title="API Offline", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,3 +17,18 @@ app.add_middleware(
 @app.get("/")
 def root():
     return {"status": "offline", "message": "This API has been wiped."}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Handlers keep no in-process state (MongoDB is the source of truth), so one worker per core is safe
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        workers=os.cpu_count(),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+    )
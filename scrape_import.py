@@ -1,23 +1,70 @@
-import json
+import hashlib
+import io
+import os
 import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from urllib.parse import urljoin
+import orjson
 import requests
 from bs4 import BeautifulSoup
-from datetime import datetime
+from datetime import datetime, timezone
+
+from text_utils import slugify
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # fall back to BeautifulSoup for chapter pages
+    LexborHTMLParser = None
 
 BASE_URL = "https://oddyssey.nikoskatsaounis.com/"
 INDEX_URL = urljoin(BASE_URL, "index.html")
+# Chapter pages are fetched concurrently with this many threads
+FETCH_WORKERS = 8
+# Fetched pages are kept here with their validators and revalidated with a
+# conditional GET on later runs; delete the directory to force a full fetch
+CACHE_DIR = Path(".scrape_cache")
 
-SLUG_RE = re.compile(r"[^a-z0-9]+")
-
-def slugify(text: str) -> str:
-    s = text.lower()
-    s = SLUG_RE.sub("-", s).strip("-")
-    return s
+def _read_cache(cache_file: Path):
+    # A missing, truncated or otherwise unreadable entry is just a cache miss;
+    # the next successful fetch overwrites it
+    try:
+        cached = orjson.loads(cache_file.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    if not isinstance(cached, dict) or not isinstance(cached.get("body"), str):
+        return None
+    return cached
 
 def fetch(url: str) -> str:
-    r = requests.get(url, timeout=20)
+    cache_file = CACHE_DIR / (hashlib.sha1(url.encode()).hexdigest() + ".json")
+    cached = _read_cache(cache_file)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    r = requests.get(url, headers=headers, timeout=20)
+    if r.status_code == 304 and cached:
+        return cached["body"]
     r.raise_for_status()
+    etag = r.headers.get("ETag")
+    last_modified = r.headers.get("Last-Modified")
+    if etag or last_modified:
+        CACHE_DIR.mkdir(exist_ok=True)
+        # Write to a temp file of its own and swap it in, so an interrupted run
+        # never leaves a partial entry and threads fetching the same URL never
+        # share one
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps({"etag": etag, "last_modified": last_modified, "body": r.text}))
+            os.replace(tmp, cache_file)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
     return r.text
 
 def extract_chapter_links(index_html: str):
@@ -42,22 +89,38 @@ def html_to_text_block(soup: BeautifulSoup) -> str:
         # fallback to body content without nav
         content_div = soup.body or soup
     parts: list[str] = []
-    # Iterate through children preserving section breaks and placeholders
-    for el in content_div.descendants:
-        if getattr(el, 'name', None) == 'p':
-            txt = el.get_text(" ", strip=False)
+    # Walk element nodes only (in document order), preserving section breaks and
+    # placeholders; only non-empty blocks are collected
+    for el in content_div.find_all(["p", "h2", "h3", "div"]):
+        name = el.name
+        if name == "p":
+            txt = el.get_text(" ", strip=False).strip()
             if txt:
-                parts.append(txt.strip())
-        elif getattr(el, 'name', None) in ('h2','h3'):
-            parts.append(f"\n\n{el.get_text(strip=True)}\n")
-        elif getattr(el, 'name', None) == 'div' and 'section-break' in (el.get('class') or []):
-            parts.append("\n***\n")
-        elif getattr(el, 'name', None) == 'div' and 'image-placeholder' in (el.get('class') or []):
-            data_id = el.get('data-image-id') or 'image'
-            parts.append(f"\n[IMAGE_PLACEHOLDER:{data_id}]\n")
-    # Join with double newlines between paragraphs
-    body = "\n\n".join([p for p in parts if p is not None and str(p).strip() != ""]).strip()
-    return body
+                parts.append(txt)
+        elif name == "div":
+            classes = el.get("class") or ()
+            if "section-break" in classes:
+                parts.append("\n***\n")
+            elif "image-placeholder" in classes:
+                data_id = el.get("data-image-id") or "image"
+                parts.append(f"\n[IMAGE_PLACEHOLDER:{data_id}]\n")
+        else:
+            heading = el.get_text(strip=True)
+            if heading:
+                parts.append(f"\n\n{heading}\n")
+    return join_blocks(parts)
+
+def join_blocks(parts) -> str:
+    # Write non-empty blocks straight into one buffer, double newlines between
+    # paragraphs, instead of filtering into a list and joining it afterwards
+    out = io.StringIO()
+    sep = ""
+    for p in parts:
+        if p and not p.isspace():
+            out.write(sep)
+            out.write(p)
+            sep = "\n\n"
+    return out.getvalue().strip()
 
 def extract_title(soup: BeautifulSoup) -> str:
     h1 = soup.find("h1")
@@ -70,20 +133,66 @@ def extract_title(soup: BeautifulSoup) -> str:
         return soup.title.string.strip()
     return "Untitled Chapter"
 
+# selectolax (lexbor) versions of the above; one CSS pass in C returns the
+# blocks in document order and each is rendered by a per-tag handler
+# Each sub-selector is a distinct tag, so no node can match twice; divs
+# without a block class are skipped by _div_block
+BLOCK_SELECTOR = "p, h2, h3, div"
+
+def _paragraph_block(node):
+    txt = node.text(separator=" ", strip=False)
+    return txt.strip() if txt else None
+
+def _heading_block(node):
+    return f"\n\n{node.text(strip=True)}\n"
+
+def _div_block(node):
+    classes = (node.attributes.get("class") or "").split()
+    if "section-break" in classes:
+        return "\n***\n"
+    if "image-placeholder" in classes:
+        data_id = node.attributes.get("data-image-id") or "image"
+        return f"\n[IMAGE_PLACEHOLDER:{data_id}]\n"
+    return None
+
+BLOCK_HANDLERS = {"p": _paragraph_block, "h2": _heading_block, "h3": _heading_block, "div": _div_block}
+
+def lexbor_text_block(tree) -> str:
+    content_div = tree.css_first(".content") or tree.body or tree.root
+    return join_blocks(BLOCK_HANDLERS[node.tag](node) for node in content_div.css(BLOCK_SELECTOR))
+
+def lexbor_title(tree) -> str:
+    h1 = tree.css_first("h1")
+    if h1 is not None and h1.text(strip=True):
+        return h1.text(strip=True)
+    title = tree.css_first("title")
+    if title is not None and title.text():
+        return title.text().strip()
+    return "Untitled Chapter"
+
+def parse_chapter(html: str):
+    """Return (title, body) of a chapter page, parsed with selectolax when installed."""
+    if LexborHTMLParser is None:
+        soup = BeautifulSoup(html, "html.parser")
+        return extract_title(soup), html_to_text_block(soup)
+    tree = LexborHTMLParser(html)
+    return lexbor_title(tree), lexbor_text_block(tree)
+
 
 def build_manifest():
     index_html = fetch(INDEX_URL)
     chapter_links = extract_chapter_links(index_html)
 
+    # Fetching is network-bound; ex.map keeps pages in link order
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+        pages = list(ex.map(fetch, [abs_url for _label, abs_url, _rel in chapter_links]))
+
     chapters = []
-    for _label, abs_url, rel in chapter_links:
-        html = fetch(abs_url)
-        soup = BeautifulSoup(html, "html.parser")
-        title = extract_title(soup)
+    for (_label, abs_url, rel), html in zip(chapter_links, pages):
+        title, body = parse_chapter(html)
         # compute order from filename
         m = re.search(r"chapter_(\d+)\.html", rel)
         order = int(m.group(1)) if m else len(chapters) + 1
-        body = html_to_text_block(soup)
         # ensure body is plain text (no control chars)
         body = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f]", "", body)
         ch = {
@@ -94,7 +203,7 @@ def build_manifest():
             "themes": [],
             "metadata": {
                 "source_url": abs_url,
-                "scraped_at": datetime.utcnow().isoformat()+"Z",
+                "scraped_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
             },
             "slug": f"chapter-{order}-{slugify(title)}",
         }
@@ -128,11 +237,10 @@ def build_manifest():
 
 def main():
     manifest = build_manifest()
-    # Validate round-trip JSON
-    data = json.dumps(manifest, ensure_ascii=False)
-    json.loads(data)
+    # orjson raises on anything it cannot encode as valid JSON, so no round-trip check is needed
+    data = orjson.dumps(manifest)
     # write out
-    with open("cleaned_import_manifest.json", "w", encoding="utf-8") as f:
+    with open("cleaned_import_manifest.json", "wb") as f:
         f.write(data)
     print("Wrote cleaned_import_manifest.json with", len(manifest["chapters"]), "chapters")
 
@@ -141,7 +249,7 @@ def main():
         resp = requests.post(
             "http://localhost:8000/api/import",
             headers={"Content-Type": "application/json"},
-            data=data.encode("utf-8"),
+            data=data,
             timeout=30,
         )
         print("Import status:", resp.status_code, resp.text[:2000])
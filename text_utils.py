@@ -0,0 +1,13 @@
+import re
+from functools import lru_cache
+
+SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+
+# The cache lives only for one script run, where chapter titles are unique;
+# it only saves work for repeated placeholder titles (e.g. "Untitled Chapter")
+@lru_cache(maxsize=1024)
+def slugify(text: str) -> str:
+    s = text.lower()
+    s = SLUG_RE.sub("-", s).strip("-")
+    return s